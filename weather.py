@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
 from typing import List, Tuple
-import requests
-import itertools
+import httpx
+import orjson
 import os
+import random
 import time
 import sys
 from datetime import datetime
@@ -17,6 +18,14 @@ if KEY is None:
 if NTFY is None:
     raise ValueError('No NTFY key provided (variable NTFY_WEATHER)')
 
+# one SSL context shared by both clients: it caches TLS session tickets
+# per host, so reconnecting after a long idle stretch (error backoff,
+# multi-hour gaps between checks) costs an abbreviated handshake of ~1 RTT
+# instead of a full one. Connections themselves still expire via
+# keepalive_expiry, so we never pin a stale server for hours. ALPN for
+# HTTP/2 is negotiated by the client transport, not the context.
+_SSL_CONTEXT = httpx.create_ssl_context()
+
 
 class Loop:
     def __init__(self, 
@@ -40,7 +49,11 @@ class Loop:
             assert 0 <= mm <= 60, mm
             rv.append((hh, mm))
         self.report_checks_at = rv
-    
+
+        # frozen lookup sets make the per-minute trigger checks O(1)
+        self._next_hour_set = frozenset(self.next_hour_checks_at)
+        self._report_set = frozenset(self.report_checks_at)
+
     def next_hour_checks_string(self) -> str:
         rv = []
         for hh, mm in self.next_hour_checks_at:
@@ -55,83 +68,83 @@ class Loop:
     
     def regular_is_triggered(self):
         now = datetime.now()
-        for hh, mm in self.next_hour_checks_at:
-            if hh == now.hour and mm == now.minute:
-                return True
-        return False
+        return (now.hour, now.minute) in self._next_hour_set
 
     def report_is_triggered(self):
         now = datetime.now()
-        for hh, mm in self.report_checks_at:
-            if hh == now.hour and mm == now.minute:
-                return True
-        return False
+        return (now.hour, now.minute) in self._report_set
+
+    def seconds_until_next_trigger(self, now: datetime = None) -> int:
+        if now is None:
+            now = datetime.now()
+        current = now.hour * 3600 + now.minute * 60 + now.second
+        deltas = []
+        for hh, mm in self._next_hour_set | self._report_set:
+            delta = (hh * 3600 + mm * 60 - current) % (24 * 3600)
+            # delta == 0 means "right now", which is either being handled
+            # already or was just missed -- aim for tomorrow instead
+            deltas.append(delta if delta > 0 else 24 * 3600)
+        return min(deltas)
 
 def simplify_hour(h: dict) -> dict:
-    uvi = h.get('uvi')
-    temp = h.get('temp') - 273.15
-    wind = h.get('wind_speed')
-    prob_rain = h.get('pop')
     rain = h.get('rain')
-
-    rv = {}
-    rv['UV'] = uvi
-    rv['COLD'] = int(temp)
-    rv['HOT'] = int(temp)
-    rv['WIND'] = int(wind)
-    rv['PROB_RAIN'] = int(prob_rain*100)
-    if rain and rain.get('1h') and rain.get('1h') > 0.2:
-        rv['RAINDROPS'] = rain.get("1h")
-
+    temp = int(h['temp'] - 273.15)
+    # single dict literal: one allocation instead of six resizing inserts
+    rv = {
+            'UV': h.get('uvi'),
+            'COLD': temp,
+            'HOT': temp,
+            'WIND': int(h['wind_speed']),
+            'PROB_RAIN': int(h['pop']*100),
+            }
+    if rain and (rain_1h := rain.get('1h', 0)) > 0.2:
+        rv['RAINDROPS'] = rain_1h
     return rv
 
 
-def condition_pairs_to_string(arr: Tuple[int, bool]) -> str:    
+def condition_pairs_to_string(arr: Tuple[int, bool]) -> str:
     good_hours = [h for h, condition in arr if condition == True]
+    if not good_hours:
+        return ''
 
-    pairs = []
-    for a, b in itertools.groupby(enumerate(good_hours), 
-            lambda pair: pair[1] - pair[0]):
-        b = list(b)
-        pairs.append((b[0][1], b[-1][1]))
-
+    # single pass over the sorted hours: flush a range whenever consecutivity breaks
     rv = []
-    for t0, t1 in pairs:
-        if t0 == t1:
-            rv.append(f'{t0}')
-        else:
-            rv.append(f'{t0}-{t1}')
+    start = prev = good_hours[0]
+    for h in good_hours[1:]:
+        if h != prev + 1:
+            rv.append(f'{start}' if start == prev else f'{start}-{prev}')
+            start = h
+        prev = h
+    rv.append(f'{start}' if start == prev else f'{start}-{prev}')
     return ', '.join(rv)
 
+# one record per condition, iterated in a single pass per Status
+_CONDS = (
+        ('PROB_RAIN', lambda x: x > 50, u"\U0001F327"),
+        ('COLD', lambda x: x < 15, u"\U0001F976"),
+        ('UV', lambda x: x > 2, u"\uE04A"),
+        ('HOT', lambda x: x > 25, u"\U0001F975"),
+        )
+CONDITIONS = {key: test for key, test, _ in _CONDS}
+EMOJIS = {key: emoji for key, _, emoji in _CONDS}
+
 class Status:
     def __init__(self, d: dict):
-        conditions = {
-                'PROB_RAIN':lambda x: x > 50,
-                'COLD': lambda x: x < 15,
-                'UV': lambda x: x > 2,
-                'HOT': lambda x: x > 25,
-                }
-        emojis = {
-                'PROB_RAIN':u"\U0001F327",
-                'COLD':u"\U0001F976",
-                'UV':u"\uE04A",
-                'HOT':u"\U0001F975",
-                }
-        self.conditions = conditions
-        self.emojis = emojis
-
-        self.values = {k:v for k, v in d.items() if k in conditions}
-        self.bools = {
-                key:test(d[key])
-                for key, test in conditions.items()
-                if key in d
-                }
-        self.warnings = {
-                key:d.get(key)
-                for key, test in self.conditions.items()
-                if key in d
-                and test(d.get(key))
-                }
+        self.conditions = CONDITIONS
+        self.emojis = EMOJIS
+
+        self.values = {}
+        self.bools = {}
+        self.warnings = {}
+        for key, test, _ in _CONDS:
+            if key not in d:
+                continue
+            value = d[key]
+            ok = test(value)
+            self.values[key] = value
+            self.bools[key] = ok
+            if ok:
+                self.warnings[key] = value
 
     def get_long_message(self) -> str:
         emojis = self.emojis
@@ -150,18 +163,124 @@ class Weather:
     def __init__(self):
         self.report_warnings = {}
         self.regular_warnings = {}
-        self._requesttemplate = f'https://api.openweathermap.org/data/3.0/onecall?lat={LAT}&lon={LON}&appid={KEY}'
+        # the query never changes, so build the full URL once instead of
+        # re-formatting the exclude suffix on every call
+        self._hourly_url = (
+                f'https://api.openweathermap.org/data/3.0/onecall'
+                f'?lat={LAT}&lon={LON}&appid={KEY}'
+                '&exclude=minutely,daily,alerts,current'
+                )
         self.is_good = True
         self.warning = ''
         self.message = ''
+        # keep one pooled client so polls reuse the (now multiplexed HTTP/2)
+        # connection instead of paying a full handshake on every check
+        self._client = httpx.Client(
+                http2=True,
+                timeout=10.0,
+                verify=_SSL_CONTEXT,
+                limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=30.0),
+                )
+        # upstream data refreshes every ~10 minutes, so a short TTL cache
+        # spares duplicate calls (and the 1000/day quota) when several
+        # triggers fire close together
+        self._cache: dict = {}
+        self._cache_ttl = 300
+        self._stale_max = 3600 # how old a cached body may be when upstream is down
+        self._validators: dict = {} # url -> conditional-request headers from the last reply
+        # persist the last response so a restart within the TTL (cron,
+        # systemd, wake from hibernation) doesn't refetch
+        self._cache_path = os.path.join(
+                os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                'dummy_weather_push.json',
+                )
+        self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self._cache_path, 'rb') as f:
+                stored = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return
+        if 'ts' not in stored or 'body' not in stored:
+            return
+        # seed even if the entry is past the TTL: an expired body still
+        # backs a conditional GET that may come back 304
+        self._cache[self._hourly_url] = (stored['ts'], stored['body'])
+        self._validators[self._hourly_url] = {
+                'etag': stored.get('etag'),
+                'last_modified': stored.get('lm'),
+                }
+
+    def _store_cache(self, url: str):
+        ts, body = self._cache[url]
+        validators = self._validators.get(url, {})
+        try:
+            os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+            tmp = self._cache_path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(orjson.dumps({
+                    'ts': ts,
+                    'etag': validators.get('etag'),
+                    'lm': validators.get('last_modified'),
+                    'body': body,
+                    }))
+            os.replace(tmp, self._cache_path) # atomic, no half-written cache
+        except OSError:
+            pass # caching is best-effort, never break a fetch over it
+
+    def _get_json(self, url: str) -> dict:
+        cached = self._cache.get(url)
+        if cached is not None and time.time() - cached[0] < self._cache_ttl:
+            return cached[1]
+
+        # ask the server to skip the body if nothing changed since last time
+        headers = {}
+        validators = self._validators.get(url, {})
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        try:
+            reply = self._client.get(url, headers=headers)
+            if reply.status_code != 304:
+                reply.raise_for_status()
+        except httpx.HTTPError:
+            # upstream is down or answering errors: a slightly stale report
+            # beats no report, so serve the last good body if recent enough;
+            # main's 'stopped working' alert then only fires when even this
+            # fallback is unavailable and the exception propagates
+            if cached is not None and time.time() - cached[0] < self._stale_max:
+                return cached[1]
+            raise
+
+        if reply.status_code == 304 and cached is not None:
+            self._cache[url] = (time.time(), cached[1])
+            self._store_cache(url)
+            return cached[1]
+
+        # orjson parses the raw bytes directly, skipping the utf-8 decode
+        # that reply.json()/.text would do
+        parsed = orjson.loads(reply.content)
+        self._cache[url] = (time.time(), parsed)
+        self._validators[url] = {
+                'etag': reply.headers.get('ETag'),
+                'last_modified': reply.headers.get('Last-Modified'),
+                }
+        self._store_cache(url)
+        return parsed
+
+    def _fetch_hourly(self) -> List[dict]:
+        return self._get_json(self._hourly_url)['hourly']
 
     def check_next_hour(self, debug = False):
-        request = f'{self._requesttemplate}&exclude=minutely,daily,alerts,current'
-        reply = requests.get(request)
         if debug:
-            return reply
-        response = reply.json()['hourly']
-        simple_dict = simplify_hour(response[0])
+            return self._client.get(self._hourly_url)
+        self._analyze_next_hour(self._fetch_hourly())
+
+    def _analyze_next_hour(self, hourly: List[dict]):
+        simple_dict = simplify_hour(hourly[0])
         status = Status(simple_dict)
         if bool(status):
             self.is_good = True
@@ -173,28 +292,37 @@ class Weather:
             self.message = status.get_long_message()
 
     def check_report(self, last_hour: int = 24):
+        self._analyze_report(self._fetch_hourly(), last_hour)
+
+    def _analyze_report(self, hourly: List[dict], last_hour: int = 24):
         assert 0 <= last_hour <= 24 # deliberate <= at the end to allow for it to be float('inf')-ish
         now = datetime.now()
-        reply = requests.get(f'{self._requesttemplate}&exclude=minutely,daily,alerts,current').json()
-        next_day = reply['hourly'][:24]
+        next_day = hourly[:24]
          
+        # 'dt' is UNIX seconds and only the local hour-of-day is needed, so
+        # compute the UTC offset once and use integer math instead of
+        # building a datetime per hour
+        utc_offset = -time.timezone + (3600 if time.daylight and time.localtime().tm_isdst else 0)
+
         # gather info about upcoming hours
         hours = []
         for hour_dict in next_day:
-            hh = datetime.fromtimestamp(hour_dict['dt']).hour
+            hh = ((hour_dict['dt'] + utc_offset) // 3600) % 24
             if hh < now.hour or hh >= last_hour: # already for tomorrow
                 break 
             simple_dict = simplify_hour(hour_dict) 
             status = Status(simple_dict)
             hours.append((hh, status))
 
+        # one pass over hours fills the array for every condition at once
+        arrays = {cond_name: [] for cond_name in EMOJIS}
+        for hh, status in hours:
+            for cond_name in EMOJIS:
+                arrays[cond_name].append((hh, status.bools.get(cond_name, False)))
+
         rv = []
-        for cond_name in Status({}).conditions:
-            emoji = Status({}).emojis[cond_name]
-            cond_arr = [
-                    (hh, status.bools.get(cond_name, False))
-                    for hh, status in hours
-                    ]
+        for cond_name, emoji in EMOJIS.items():
+            cond_arr = arrays[cond_name]
             if any([pair[1] for pair in cond_arr]):
                 range_string = condition_pairs_to_string(cond_arr)
                 msg = f'{emoji}: {range_string}'
@@ -213,22 +341,38 @@ class Weather:
 class Notifications:
     def __init__(self):
         self.target = f"https://ntfy.sh/{NTFY}"
+        self._client = httpx.Client(
+                http2=True,
+                timeout=10.0,
+                verify=_SSL_CONTEXT,
+                limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=30.0),
+                )
         print(f"Subscribe to: {self.target}")
 
     def update(self, weather):
-        warning = weather.warning
-        message = weather.message
-        status = weather.is_good
+        self.update_batch([(weather.is_good, weather.warning, weather.message)])
+
+    def update_batch(self, items: List[Tuple[bool, str, str]]):
+        # coalesce everything a tick produced into one POST, so overlapping
+        # triggers cost one round trip and one notification flash
+        if not items:
+            return
+        if len(items) == 1:
+            status, warning, message = items[0]
+        else:
+            status = all(s for s, _, _ in items)
+            warning = '; '.join(w for _, w, _ in items if w)
+            message = '\n---\n'.join(m for _, _, m in items)
         status_emoji = "\N{large green circle}" if status == True else "\N{large red circle}"
 
-        requests.post(
+        self._client.post(
                 self.target,
-                data = message.encode('utf-8'),
+                content = message.encode('utf-8'),
                 headers = {f'Title':": ".join([status_emoji, warning]).encode('utf-8')}
                 )
 
     def post(self, *a, **kwa):
-        requests.post(
+        self._client.post(
                 self.target,
                 *a, **kwa
                 )
@@ -238,51 +382,61 @@ def main(args: List[str]):
     weather = Weather()
     notifications = Notifications()
     notifications.post(
-            data=(
+            content=(
                 f'Started script at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\n'
                 f'Report checks at: {loop.report_checks_string()}\n'
                 f'Regular checks at: {loop.next_hour_checks_string()}'
                 )
             )
-    has_broken = False
-    sleep = 60
+    failures = 0
 
     while True:
-        assert sleep >= 60, f"if sleep is less than 60, it will break the script logic and send notifications few times in a minute; you have {sleep}"
         try:
-            if loop.report_is_triggered():
-                weather.check_report()
-                notifications.update(weather) 
-            if loop.regular_is_triggered():
-                weather.check_next_hour()
+            report = loop.report_is_triggered()
+            regular = loop.regular_is_triggered()
+            if report or regular:
+                # one fetch feeds both analyzers when triggers overlap
+                hourly = weather._fetch_hourly()
+            pending = []
+            if report:
+                weather._analyze_report(hourly)
+                pending.append((weather.is_good, weather.warning, weather.message))
+            if regular:
+                weather._analyze_next_hour(hourly)
                 if not weather.is_good:
-                    notifications.update(weather) 
-            sleep = 60
-            has_broken = False
+                    pending.append((weather.is_good, weather.warning, weather.message))
+            if pending:
+                notifications.update_batch(pending)
+            # sleep until the next scheduled check instead of waking every
+            # minute; recomputed after every wake so clock jumps
+            # (hibernation, suspend) only cost one missed trigger at most
+            sleep = loop.seconds_until_next_trigger()
+            failures = 0
         except Exception as e:
-            if not has_broken:
-                has_broken = True
+            failures += 1
+            if failures == 1:
                 notifications.post(
-                        data = (
+                        content = (
                             f'Stopped working at: {datetime.now().strftime("%H:%M")}\n'
                             f'reason is: {e}\n'
-                            'will now check every 15 minutes but push priority will be minimal'
+                            'will retry with exponential backoff but push priority will be minimal'
                             ),
                         headers = {f'Title': 'weather stopped working', 'Priority':'max'}
                     )
-                sleep = 60*15
-            else:
+            elif failures in (4, 8): # log-scale reminders instead of one per retry
                 notifications.post(
-                        data = f'still not working at: {datetime.now().strftime("%H:%M")}',
+                        content = f'still not working at: {datetime.now().strftime("%H:%M")} (attempt {failures})',
                         headers = {f'Title': 'weather not working', 'Priority':'min'}
                     )
-                sleep = 3600
+            # exponential backoff capped at an hour, jittered so restarts
+            # across machines don't hammer the API in sync
+            sleep = min(3600, 60 * 2**failures) + random.uniform(0, 30)
 
         # weather.check_next_hour()
         # weather.check_report()
         # notifications.update(weather)
-    
-        time.sleep(sleep)
+
+        time.sleep(max(1, sleep))
 
 if __name__ == '__main__':
     main(sys.argv[1:])